@@ -4,6 +4,9 @@ import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import numpy as np
+import os
+import tempfile
+from pathlib import Path
 from datetime import datetime, timedelta
 
 # Configuração da página
@@ -19,20 +22,95 @@ st.title("🚛 Dashboard de KPIs - Gestão de Frotas")
 st.markdown("---")
 
 # Carregar dados
+ARQUIVO_CSV = Path('kpis_frota_ficticios.csv')
+# Incrementar sempre que mudarem as colunas, os dtypes ou as colunas derivadas do load_data
+VERSAO_CACHE = 1
+ARQUIVO_PARQUET = Path(f'kpis_frota_ficticios.v{VERSAO_CACHE}.parquet')
+
+# Na mesma ordem do CSV: o engine pyarrow devolve as colunas na ordem desta lista
+COLUNAS_UTILIZADAS = [
+    'Data',
+    'ID_Veiculo',
+    'Modelo',
+    'KM_Rodado',
+    'Litros_Consumidos',
+    'Media_Consumo_KML',
+    'Custo_Combustivel',
+    'Custo_Manutencao',
+    'Custo_Multas',
+    'Tempo_Parada_Manutencao_Horas',
+    'Acidentes'
+]
+
 @st.cache_data
 def load_data():
-    df = pd.read_csv('kpis_frota_ficticios.csv')
-    df['Data'] = pd.to_datetime(df['Data'])
+    # Parquet já tipado e indexado, regenerado sempre que o CSV for mais recente
+    if ARQUIVO_PARQUET.exists() and (
+        not ARQUIVO_CSV.exists() or ARQUIVO_PARQUET.stat().st_mtime >= ARQUIVO_CSV.stat().st_mtime
+    ):
+        try:
+            df = pd.read_parquet(ARQUIVO_PARQUET)
+            if list(df.columns) == COLUNAS_UTILIZADAS[1:] + ['Custo_Total']:
+                return df
+        except (OSError, ValueError):
+            pass  # Cache corrompido: reconstrói a partir do CSV
+    
+    df = pd.read_csv(
+        ARQUIVO_CSV,
+        engine='pyarrow',
+        usecols=COLUNAS_UTILIZADAS,
+        parse_dates=['Data'],
+        # Custos, litros e consumo ficam em float64: em float32 os totais perdem os centavos e a exportação arredonda
+        dtype={
+            'KM_Rodado': 'float32',
+            'Litros_Consumidos': 'float64',
+            'Media_Consumo_KML': 'float64',
+            'Custo_Combustivel': 'float64',
+            'Custo_Manutencao': 'float64',
+            'Custo_Multas': 'float64',
+            'Acidentes': 'int16',
+            'Tempo_Parada_Manutencao_Horas': 'float32',
+            'Modelo': 'category',
+            'ID_Veiculo': 'category'
+        }
+    )
+    # Coluna derivada (float64, como as parcelas); não faz parte dos dados brutos exportados
+    df['Custo_Total'] = df['Custo_Combustivel'] + df['Custo_Manutencao'] + df['Custo_Multas']
+    # Índice de datas ordenado permite filtrar o período por busca binária
+    df = df.sort_values('Data', kind='stable').set_index('Data')
+    
+    # Grava num arquivo temporário e troca de uma vez, para nunca deixar um cache parcial
+    arquivo_temp = None
+    try:
+        fd, arquivo_temp = tempfile.mkstemp(
+            dir=ARQUIVO_PARQUET.parent, prefix=ARQUIVO_PARQUET.name, suffix='.tmp'
+        )
+        os.close(fd)
+        df.to_parquet(arquivo_temp)
+        os.replace(arquivo_temp, ARQUIVO_PARQUET)
+    except OSError:
+        # Diretório somente leitura ou disco cheio: segue usando o CSV
+        if arquivo_temp is not None and os.path.exists(arquivo_temp):
+            os.remove(arquivo_temp)
     return df
 
+@st.cache_data
+def dropdown_options(_df):
+    # _df vem do load_data memoizado; não é hasheado a cada rerun
+    return (
+        ['Todos'] + _df['Modelo'].cat.categories.tolist(),
+        ['Todos'] + _df['ID_Veiculo'].cat.categories.tolist()
+    )
+
 df = load_data()
+modelos_disponiveis, veiculos_disponiveis = dropdown_options(df)
 
 # Sidebar com filtros
 st.sidebar.header("🔧 Filtros")
 
 # Filtro por período
-min_date = df['Data'].min()
-max_date = df['Data'].max()
+min_date = df.index.min()
+max_date = df.index.max()
 date_range = st.sidebar.date_input(
     "Período:",
     value=(min_date, max_date),
@@ -41,34 +119,124 @@ date_range = st.sidebar.date_input(
 )
 
 # Filtro por modelo
-modelos_disponiveis = ['Todos'] + list(df['Modelo'].unique())
 modelo_selecionado = st.sidebar.selectbox("Modelo:", modelos_disponiveis)
 
 # Filtro por veículo
-veiculos_disponiveis = ['Todos'] + list(df['ID_Veiculo'].unique())
 veiculo_selecionado = st.sidebar.selectbox("Veículo:", veiculos_disponiveis)
 
 # Aplicar filtros
-df_filtrado = df.copy()
+# Limite de entradas por função em cache: cada seleção de filtros guarda uma cópia
+# dos dados, então sem limite a memória do servidor cresceria sem parar
+MAX_ENTRADAS_CACHE = 64
+
+# Os dados vêm do load_data já memoizado, então o cache é indexado apenas pelos
+# valores dos filtros; os parâmetros com "_" não são hasheados pelo Streamlit
+@st.cache_data(max_entries=MAX_ENTRADAS_CACHE)
+def apply_filters(_df, start, end, modelo, veiculo):
+    # Filtro de data (fatia do índice ordenado)
+    df = _df.loc[pd.Timestamp(start):pd.Timestamp(end)]
+    
+    # Filtro de modelo
+    if modelo != 'Todos':
+        df = df[df['Modelo'].values == modelo]
+    
+    # Filtro de veículo
+    if veiculo != 'Todos':
+        df = df[df['ID_Veiculo'].values == veiculo]
+    
+    # Agregados derivados do recorte, memoizados junto com ele
+    return df, operational_data(df), daily_totals(df), totals_by_vehicle(df), totals_by_model(df)
+
+def operational_data(df_f):
+    return df_f[df_f['KM_Rodado'].values > 0]
+
+def totals_by_vehicle(df_f):
+    return df_f.groupby('ID_Veiculo', observed=True, sort=False).agg(
+        Custo_Total=('Custo_Total', 'sum'),
+        Tempo_Parada_Manutencao_Horas=('Tempo_Parada_Manutencao_Horas', 'sum'),
+        Registros=('Tempo_Parada_Manutencao_Horas', 'size')
+    )
+
+def totals_by_model(df_f):
+    return df_f.groupby('Modelo', observed=True, sort=False).agg(
+        Custo_Manutencao=('Custo_Manutencao', 'sum'),
+        Custo_Multas=('Custo_Multas', 'sum'),
+        Acidentes=('Acidentes', 'sum'),
+        KM_Rodado=('KM_Rodado', 'sum')
+    )
+
+def daily_totals(df_f):
+    diario = df_f[[
+        'Custo_Combustivel',
+        'Custo_Manutencao',
+        'Custo_Multas',
+        'KM_Rodado'
+    ]].assign(
+        # Litros apenas dos registros operacionais (KM_Rodado > 0), como no df_operacional
+        Litros_Operacionais=df_f['Litros_Consumidos'].where(df_f['KM_Rodado'] > 0, 0)
+    )
+    return diario.groupby(level=0, sort=False).sum()  # só os dias presentes no recorte
+
+# filtros não é usado no corpo: identifica no cache o recorte _df_f, que não é hasheado
+@st.cache_data(max_entries=MAX_ENTRADAS_CACHE)
+def to_csv_bytes(_df_f, filtros):
+    return _df_f.drop(columns='Custo_Total').to_csv().encode('utf-8')
+
+# Gráficos: só os do plotly.express são memoizados, pelos dados agregados que recebem
+@st.cache_data(max_entries=MAX_ENTRADAS_CACHE)
+def bar_chart(data, x, y, title, labels=None, orientation=None):
+    return px.bar(data, x=x, y=y, title=title, labels=labels, orientation=orientation)
+
+@st.cache_data(max_entries=MAX_ENTRADAS_CACHE)
+def pie_chart(data, values, names, title):
+    return px.pie(data, values=values, names=names, title=title)
+
+# Figuras go montadas direto: num acerto de cache a figura é reconstruída e
+# revalidada ao ser desserializada, o que sai mais caro do que montá-la de novo
+def cost_evolution_chart(custos_tempo):
+    fig = go.Figure(data=[
+        go.Scattergl(
+            x=custos_tempo['Data'], 
+            y=custos_tempo[coluna],
+            mode='lines+markers',
+            name=nome
+        )
+        for coluna, nome in zip(
+            ['Custo_Combustivel', 'Custo_Manutencao', 'Custo_Multas'],
+            ['Combustível', 'Manutenção', 'Multas']
+        )
+    ])
+    fig.update_layout(title="Evolução dos Custos ao Longo do Tempo")
+    return fig
+
+def operation_timeline_chart(operacao_tempo):
+    fig = make_subplots(
+        rows=2, cols=1,
+        subplot_titles=('KM Rodados por Dia', 'Consumo Médio Diário'),
+        vertical_spacing=0.1
+    )
+    
+    fig.add_traces(
+        [
+            go.Scattergl(x=operacao_tempo['Data'], y=operacao_tempo['KM_Rodado'], name='KM Rodados'),
+            go.Scattergl(x=operacao_tempo['Data'], y=operacao_tempo['Consumo_Diario'], name='Consumo (KM/L)')
+        ],
+        rows=[1, 2], cols=[1, 1]
+    )
+    
+    fig.update_layout(height=600, title_text="Análise Temporal da Operação")
+    return fig
 
 # Filtro de data
 if len(date_range) == 2:
     start_date, end_date = date_range
-    df_filtrado = df_filtrado[
-        (df_filtrado['Data'] >= pd.to_datetime(start_date)) & 
-        (df_filtrado['Data'] <= pd.to_datetime(end_date))
-    ]
-
-# Filtro de modelo
-if modelo_selecionado != 'Todos':
-    df_filtrado = df_filtrado[df_filtrado['Modelo'] == modelo_selecionado]
+else:
+    start_date, end_date = min_date, max_date
 
-# Filtro de veículo
-if veiculo_selecionado != 'Todos':
-    df_filtrado = df_filtrado[df_filtrado['ID_Veiculo'] == veiculo_selecionado]
+filtros = (start_date, end_date, modelo_selecionado, veiculo_selecionado)
 
 # Calcular KPIs principais
-df_operacional = df_filtrado[df_filtrado['KM_Rodado'] > 0]
+df_filtrado, df_operacional, df_diario, totais_veiculo, totais_modelo = apply_filters(df, *filtros)
 
 # Métricas principais
 col1, col2, col3, col4, col5 = st.columns(5)
@@ -82,9 +250,7 @@ with col2:
     st.metric("Consumo Médio", f"{consumo_medio:.2f} KM/L")
 
 with col3:
-    custo_total = (df_filtrado['Custo_Combustivel'] + 
-                   df_filtrado['Custo_Manutencao'] + 
-                   df_filtrado['Custo_Multas']).sum()
+    custo_total = df_filtrado['Custo_Total'].sum()
     st.metric("Custo Total", f"R$ {custo_total:,.2f}")
 
 with col4:
@@ -116,7 +282,7 @@ with tab1:
             ]
         })
         
-        fig_custos = px.pie(
+        fig_custos = pie_chart(
             custos_categoria, 
             values='Valor', 
             names='Categoria',
@@ -126,47 +292,16 @@ with tab1:
     
     with col2:
         # Evolução dos custos ao longo do tempo
-        custos_tempo = df_filtrado.groupby('Data').agg({
-            'Custo_Combustivel': 'sum',
-            'Custo_Manutencao': 'sum',
-            'Custo_Multas': 'sum'
-        }).reset_index()
+        custos_tempo = df_diario[['Custo_Combustivel', 'Custo_Manutencao', 'Custo_Multas']].reset_index()
         
-        fig_evolucao = go.Figure()
-        fig_evolucao.add_trace(go.Scatter(
-            x=custos_tempo['Data'], 
-            y=custos_tempo['Custo_Combustivel'],
-            mode='lines+markers',
-            name='Combustível'
-        ))
-        fig_evolucao.add_trace(go.Scatter(
-            x=custos_tempo['Data'], 
-            y=custos_tempo['Custo_Manutencao'],
-            mode='lines+markers',
-            name='Manutenção'
-        ))
-        fig_evolucao.add_trace(go.Scatter(
-            x=custos_tempo['Data'], 
-            y=custos_tempo['Custo_Multas'],
-            mode='lines+markers',
-            name='Multas'
-        ))
-        fig_evolucao.update_layout(title="Evolução dos Custos ao Longo do Tempo")
+        fig_evolucao = cost_evolution_chart(custos_tempo)
         st.plotly_chart(fig_evolucao, use_container_width=True)
     
     # Ranking de custos por veículo
     st.subheader("🏆 Ranking de Custos por Veículo")
-    custos_veiculo = df_filtrado.groupby('ID_Veiculo').agg({
-        'Custo_Combustivel': 'sum',
-        'Custo_Manutencao': 'sum',
-        'Custo_Multas': 'sum'
-    }).reset_index()
-    custos_veiculo['Custo_Total'] = (custos_veiculo['Custo_Combustivel'] + 
-                                     custos_veiculo['Custo_Manutencao'] + 
-                                     custos_veiculo['Custo_Multas'])
-    custos_veiculo = custos_veiculo.sort_values('Custo_Total', ascending=False).head(10)
+    custos_veiculo = totais_veiculo['Custo_Total'].nlargest(10).reset_index()
     
-    fig_ranking = px.bar(
+    fig_ranking = bar_chart(
         custos_veiculo, 
         x='ID_Veiculo', 
         y='Custo_Total',
@@ -181,10 +316,10 @@ with tab2:
     
     with col1:
         # Consumo médio por modelo
-        consumo_modelo = df_operacional.groupby('Modelo')['Media_Consumo_KML'].mean().reset_index()
+        consumo_modelo = df_operacional.groupby('Modelo', observed=True, sort=False)['Media_Consumo_KML'].mean().reset_index()
         consumo_modelo = consumo_modelo.sort_values('Media_Consumo_KML', ascending=False)
         
-        fig_consumo = px.bar(
+        fig_consumo = bar_chart(
             consumo_modelo,
             x='Modelo',
             y='Media_Consumo_KML',
@@ -195,10 +330,10 @@ with tab2:
     
     with col2:
         # Utilização da frota (KM rodados por veículo)
-        utilizacao_frota = df_operacional.groupby('ID_Veiculo')['KM_Rodado'].sum().reset_index()
-        utilizacao_frota = utilizacao_frota.sort_values('KM_Rodado', ascending=False).head(10)
+        utilizacao_frota = df_operacional.groupby('ID_Veiculo', observed=True, sort=False)['KM_Rodado'].sum().reset_index()
+        utilizacao_frota = utilizacao_frota.nlargest(10, 'KM_Rodado')
         
-        fig_utilizacao = px.bar(
+        fig_utilizacao = bar_chart(
             utilizacao_frota,
             x='ID_Veiculo',
             y='KM_Rodado',
@@ -209,29 +344,11 @@ with tab2:
     
     # Análise temporal da operação
     st.subheader("📈 Análise Temporal da Operação")
-    operacao_tempo = df_operacional.groupby('Data').agg({
-        'KM_Rodado': 'sum',
-        'Litros_Consumidos': 'sum'
-    }).reset_index()
-    operacao_tempo['Consumo_Diario'] = operacao_tempo['KM_Rodado'] / operacao_tempo['Litros_Consumidos']
+    # Apenas dias com KM rodado, como no df_operacional
+    operacao_tempo = df_diario.loc[df_diario['KM_Rodado'] > 0, ['KM_Rodado', 'Litros_Operacionais']].reset_index()
+    operacao_tempo['Consumo_Diario'] = operacao_tempo['KM_Rodado'] / operacao_tempo['Litros_Operacionais']
     
-    fig_temporal = make_subplots(
-        rows=2, cols=1,
-        subplot_titles=('KM Rodados por Dia', 'Consumo Médio Diário'),
-        vertical_spacing=0.1
-    )
-    
-    fig_temporal.add_trace(
-        go.Scatter(x=operacao_tempo['Data'], y=operacao_tempo['KM_Rodado'], name='KM Rodados'),
-        row=1, col=1
-    )
-    
-    fig_temporal.add_trace(
-        go.Scatter(x=operacao_tempo['Data'], y=operacao_tempo['Consumo_Diario'], name='Consumo (KM/L)'),
-        row=2, col=1
-    )
-    
-    fig_temporal.update_layout(height=600, title_text="Análise Temporal da Operação")
+    fig_temporal = operation_timeline_chart(operacao_tempo)
     st.plotly_chart(fig_temporal, use_container_width=True)
 
 with tab3:
@@ -241,10 +358,9 @@ with tab3:
     
     with col1:
         # Custos de manutenção por modelo
-        manutencao_modelo = df_filtrado.groupby('Modelo')['Custo_Manutencao'].sum().reset_index()
-        manutencao_modelo = manutencao_modelo.sort_values('Custo_Manutencao', ascending=False)
+        manutencao_modelo = totais_modelo['Custo_Manutencao'].sort_values(ascending=False).reset_index()
         
-        fig_manutencao = px.bar(
+        fig_manutencao = bar_chart(
             manutencao_modelo,
             x='Modelo',
             y='Custo_Manutencao',
@@ -254,10 +370,9 @@ with tab3:
     
     with col2:
         # Tempo de parada por manutenção
-        parada_veiculo = df_filtrado.groupby('ID_Veiculo')['Tempo_Parada_Manutencao_Horas'].sum().reset_index()
-        parada_veiculo = parada_veiculo.sort_values('Tempo_Parada_Manutencao_Horas', ascending=False).head(10)
+        parada_veiculo = totais_veiculo['Tempo_Parada_Manutencao_Horas'].nlargest(10).reset_index()
         
-        fig_parada = px.bar(
+        fig_parada = bar_chart(
             parada_veiculo,
             x='ID_Veiculo',
             y='Tempo_Parada_Manutencao_Horas',
@@ -269,22 +384,12 @@ with tab3:
     st.subheader("📊 Disponibilidade da Frota")
     
     # Calcular disponibilidade (assumindo 24h por dia como tempo total possível)
-    disponibilidade_data = []
-    for veiculo in df_filtrado['ID_Veiculo'].unique():
-        df_veiculo = df_filtrado[df_filtrado['ID_Veiculo'] == veiculo]
-        tempo_total_possivel = len(df_veiculo) * 24  # 24 horas por dia
-        tempo_parada = df_veiculo['Tempo_Parada_Manutencao_Horas'].sum()
-        disponibilidade = ((tempo_total_possivel - tempo_parada) / tempo_total_possivel) * 100
-        
-        disponibilidade_data.append({
-            'Veiculo': veiculo,
-            'Disponibilidade': disponibilidade
-        })
+    tempo_total_possivel = totais_veiculo['Registros'] * 24  # 24 horas por dia
+    disponibilidade = ((tempo_total_possivel - totais_veiculo['Tempo_Parada_Manutencao_Horas']) / tempo_total_possivel) * 100
     
-    df_disponibilidade = pd.DataFrame(disponibilidade_data)
-    df_disponibilidade = df_disponibilidade.sort_values('Disponibilidade', ascending=True).head(10)
+    df_disponibilidade = disponibilidade.nsmallest(10).rename('Disponibilidade').rename_axis('Veiculo').reset_index()
     
-    fig_disponibilidade = px.bar(
+    fig_disponibilidade = bar_chart(
         df_disponibilidade,
         x='Disponibilidade',
         y='Veiculo',
@@ -301,10 +406,9 @@ with tab4:
     
     with col1:
         # Acidentes por modelo
-        acidentes_modelo = df_filtrado.groupby('Modelo')['Acidentes'].sum().reset_index()
-        acidentes_modelo = acidentes_modelo.sort_values('Acidentes', ascending=False)
+        acidentes_modelo = totais_modelo['Acidentes'].sort_values(ascending=False).reset_index()
         
-        fig_acidentes = px.bar(
+        fig_acidentes = bar_chart(
             acidentes_modelo,
             x='Modelo',
             y='Acidentes',
@@ -314,10 +418,9 @@ with tab4:
     
     with col2:
         # Multas por modelo
-        multas_modelo = df_filtrado.groupby('Modelo')['Custo_Multas'].sum().reset_index()
-        multas_modelo = multas_modelo.sort_values('Custo_Multas', ascending=False)
+        multas_modelo = totais_modelo['Custo_Multas'].sort_values(ascending=False).reset_index()
         
-        fig_multas = px.bar(
+        fig_multas = bar_chart(
             multas_modelo,
             x='Modelo',
             y='Custo_Multas',
@@ -328,26 +431,20 @@ with tab4:
     # Índice de acidentes por KM
     st.subheader("📈 Índice de Segurança")
     
-    seguranca_data = []
-    for modelo in df_filtrado['Modelo'].unique():
-        df_modelo = df_filtrado[df_filtrado['Modelo'] == modelo]
-        km_total_modelo = df_modelo['KM_Rodado'].sum()
-        acidentes_total_modelo = df_modelo['Acidentes'].sum()
-        
-        if km_total_modelo > 0:
-            indice_acidentes = (acidentes_total_modelo / km_total_modelo) * 1000000  # Por milhão de KM
-        else:
-            indice_acidentes = 0
-        
-        seguranca_data.append({
-            'Modelo': modelo,
-            'Indice_Acidentes_por_Milhao_KM': indice_acidentes
-        })
+    km_modelo = totais_modelo['KM_Rodado'].to_numpy()
+    acidentes_modelo_total = totais_modelo['Acidentes'].to_numpy()
+    indice_acidentes = np.divide(
+        acidentes_modelo_total, km_modelo,
+        out=np.zeros(len(km_modelo)),
+        where=km_modelo > 0
+    ) * 1000000  # Por milhão de KM
     
-    df_seguranca = pd.DataFrame(seguranca_data)
-    df_seguranca = df_seguranca.sort_values('Indice_Acidentes_por_Milhao_KM', ascending=False)
+    df_seguranca = pd.DataFrame({
+        'Modelo': totais_modelo.index,
+        'Indice_Acidentes_por_Milhao_KM': indice_acidentes
+    }).sort_values('Indice_Acidentes_por_Milhao_KM', ascending=False)
     
-    fig_indice = px.bar(
+    fig_indice = bar_chart(
         df_seguranca,
         x='Modelo',
         y='Indice_Acidentes_por_Milhao_KM',
@@ -359,17 +456,26 @@ with tab4:
 st.markdown("---")
 st.subheader("📋 Dados Brutos")
 
-# Opção para baixar dados
-csv = df_filtrado.to_csv(index=False)
+# Opção para baixar dados (o CSV só é gerado quando o botão é clicado)
 st.download_button(
     label="📥 Baixar dados filtrados como CSV",
-    data=csv,
+    data=lambda: to_csv_bytes(df_filtrado, filtros),
     file_name='kpis_frota_filtrados.csv',
     mime='text/csv'
 )
 
-# Mostrar tabela
-st.dataframe(df_filtrado, use_container_width=True)
+# Mostrar tabela (limitada por padrão para não enviar o período inteiro ao navegador)
+LIMITE_LINHAS_TABELA = 1000
+mostrar_todos = False
+if len(df_filtrado) > LIMITE_LINHAS_TABELA:
+    mostrar_todos = st.checkbox("Mostrar todos os registros")
+    if not mostrar_todos:
+        st.caption(f"Exibindo os primeiros {LIMITE_LINHAS_TABELA} de {len(df_filtrado)} registros.")
+
+if mostrar_todos:
+    st.dataframe(df_filtrado.drop(columns='Custo_Total'), use_container_width=True)
+else:
+    st.dataframe(df_filtrado.head(LIMITE_LINHAS_TABELA).drop(columns='Custo_Total'), use_container_width=True)
 
 # Rodapé
 st.markdown("---")